@@ -1,20 +1,32 @@
 from fastmcp import FastMCP
-from tools.sample_downloader import download_samples as download_samples_api
+from tools.sample_downloader import SampleDownloaderAPI
 from tools.rule_hash_query import RuleHashQuery
+import functools
 import os
 import json
 
+# Prefer orjson for faster JSON parsing when it is installed
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
 # Create an MCP server
 mcp = FastMCP("apt-analysis")
 
 # Initialize rule hash query
 rule_query = None
 
+@functools.lru_cache(maxsize=None)
+def _load_config_cached(config_path: str, mtime_ns: int) -> dict:
+    with open(config_path, "rb") as f:
+        return _json_loads(f.read())
+
 def load_config():
-    """Load configuration from config.json"""
+    """Load configuration from config.json, cached until the file changes"""
     config_path = os.path.join(os.path.dirname(__file__), "config.json")
-    with open(config_path, "r") as f:
-        return json.load(f)
+    return _load_config_cached(config_path, os.stat(config_path).st_mtime_ns)
 
 # Load config globally
 config = load_config()
@@ -28,6 +40,26 @@ except Exception as e:
     print(f"Warning: Failed to load rule hash mapping: {e}", flush=True)
     rule_query = None
 
+# Build the downloader once at startup; it is reused by every tool call,
+# which also lets its SSH connection multiplexing span calls.
+try:
+    _jumper = config["jumper"]
+    _target = config["target"]
+    downloader = SampleDownloaderAPI(
+        jumper_user=_jumper["user"],
+        jumper_host=_jumper["host"],
+        jumper_port=_jumper["port"],
+        jumper_key=_jumper["key"],
+        target_user=_target["user"],
+        target_host=_target["host"],
+        target_port=_target["port"],
+        target_key=_target["key"],
+        target_workdir=_target["workdir"]
+    )
+except Exception as e:
+    print(f"Warning: Failed to initialize sample downloader: {e}", flush=True)
+    downloader = None
+
 @mcp.tool()
 def download_samples(hash_list: list[str], output_dir: str = None) -> str:
     """
@@ -37,25 +69,22 @@ def download_samples(hash_list: list[str], output_dir: str = None) -> str:
         hash_list: List of SHA256 hashes to download.
         output_dir: Local directory to save samples to. Defaults to config value.
     """
+    if downloader is None:
+        return "Failed to download samples: downloader not configured. Please check config.json."
+
     # Use default from config if not provided
     if output_dir is None:
         output_dir = config.get("local_download_dir", "/tmp/samples")
 
-    # Construct config dictionaries expected by the API
-    jumper_config = config["jumper"]
-    target_config = config["target"]
-
     # Use a print logger for MCP logging if needed, or just silence it
     def log_callback(msg):
         # In a real MCP server, we might want to log this to stderr or via MCP logs
         # For now, we'll keep it simple
         pass
 
-    success, path, error = download_samples_api(
+    success, path, error = downloader.download_samples(
         hash_list=hash_list,
         local_output_dir=output_dir,
-        jumper_config=jumper_config,
-        target_config=target_config,
         output_dirname="mcp_download",
         flat_output=True,
         log_callback=log_callback
@@ -99,31 +128,24 @@ def get_rule_sha256_list(rule: str, namespace: str = None) -> dict:
             "error": "Rule hash mapping not loaded. Please ensure Rule_Hash_Mapping.csv exists."
         }
     
-    try:
-        sha256_hashes = rule_query.get_sha256_list(rule, namespace)
-        
-        if not sha256_hashes:
-            return {
-                "success": False,
-                "sha256_hashes": [],
-                "count": 0,
-                "error": f"No SHA256 hashes found for rule: {rule}"
-            }
-        
-        return {
-            "success": True,
-            "sha256_hashes": sha256_hashes,
-            "count": len(sha256_hashes),
-            "error": None
-        }
-    
-    except Exception as e:
+    # The lookup is a total function over the in-memory mapping (missing
+    # rules just come back empty), so no exception guard is needed here.
+    sha256_hashes = rule_query.get_sha256_list(rule, namespace)
+
+    if not sha256_hashes:
         return {
             "success": False,
             "sha256_hashes": [],
             "count": 0,
-            "error": str(e)
+            "error": f"No SHA256 hashes found for rule: {rule}"
         }
 
+    return {
+        "success": True,
+        "sha256_hashes": sha256_hashes,
+        "count": len(sha256_hashes),
+        "error": None
+    }
+
 if __name__ == "__main__":
     mcp.run()
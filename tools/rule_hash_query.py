@@ -3,9 +3,15 @@ YARA规则Hash查询工具
 根据rule和namespace查询对应的样本SHA256 hash
 """
 import csv
+import functools
 import os
+import pickle
+import re
 from typing import List, Optional, Tuple
 
+# SHA256为固定64位十六进制，用正则直接提取，顺带过滤掉非法条目
+_SHA256_RE = re.compile(r'[0-9a-fA-F]{64}')
+
 
 class RuleHashQuery:
     """YARA规则Hash查询类"""
@@ -25,60 +31,133 @@ class RuleHashQuery:
         
         self.mapping_file = mapping_file
         self.mapping = {}
+        # 规则名 -> namespace列表 的二级索引，加速不带namespace的查询
+        self.rule_index = {}
         self._load_mapping()
+        # 映射表加载后不再变化，相同(rule, namespace)的查询结果可直接缓存复用
+        self._cached_sha256 = functools.lru_cache(maxsize=4096)(self._get_sha256_tuple)
     
     def _load_mapping(self):
-        """加载规则Hash映射表"""
+        """加载规则Hash映射表，优先使用已缓存的解析结果"""
         if not os.path.exists(self.mapping_file):
             raise FileNotFoundError(
                 f"映射文件不存在: {self.mapping_file}\n"
                 f"请先运行 'python3 build_rule_hash_mapping.py' 生成映射表"
             )
-        
+
+        # CSV未更新时直接加载pickle缓存，跳过整个CSV解析过程
+        cache_file = self.mapping_file + '.pkl'
+        if self._load_cache(cache_file):
+            return
+
         try:
-            with open(self.mapping_file, 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    rule = row['rule']
-                    namespace = row['namespace']
-                    sha256_list = row.get('sha256List', '')
-                    
-                    key = (rule, namespace)
-                    self.mapping[key] = sha256_list
+            # 优先使用pandas的C解析器，未安装时回退到标准库csv
+            if not self._load_csv_pandas():
+                self._load_csv_stdlib()
         except Exception as e:
             raise Exception(f"读取映射文件失败: {e}")
-    
+
+        self._save_cache(cache_file)
+
+    def _add_row(self, rule: str, namespace: str, sha256_str: str):
+        """解析一行记录，写入映射表和二级索引"""
+        # sha256列表为空的行对查询没有意义，直接跳过以缩小映射表
+        if not sha256_str:
+            return
+        # 正则一次性提取所有hash，整个循环在C层完成，
+        # 同时替代split/strip并过滤掉格式非法的条目
+        sha256_tuple = tuple(_SHA256_RE.findall(sha256_str))
+        if not sha256_tuple:
+            return
+        key = (rule, namespace)
+        # CSV中重复的(rule, namespace)行只在索引中记录一次
+        if key not in self.mapping:
+            self.rule_index.setdefault(rule, []).append(namespace)
+        self.mapping[key] = sha256_tuple
+
+    def _load_csv_pandas(self) -> bool:
+        """使用pandas的C解析器加载CSV，pandas未安装时返回False"""
+        try:
+            import pandas
+        except ImportError:
+            return False
+
+        df = pandas.read_csv(
+            self.mapping_file,
+            usecols=['rule', 'namespace', 'sha256List'],
+            dtype=str,
+            na_filter=False,
+            engine='c'
+        )
+        for rule, namespace, sha256_str in zip(
+            df['rule'].values, df['namespace'].values, df['sha256List'].values
+        ):
+            self._add_row(rule, namespace, sha256_str)
+        return True
+
+    def _load_csv_stdlib(self):
+        """使用标准库csv加载映射文件"""
+        with open(self.mapping_file, 'r', encoding='utf-8', newline='') as f:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if header is None:
+                return
+            # 只读取一次表头，后续按固定列索引取值，避免逐行构造dict
+            rule_idx = header.index('rule')
+            namespace_idx = header.index('namespace')
+            sha256_idx = header.index('sha256List')
+            for row in reader:
+                self._add_row(row[rule_idx], row[namespace_idx], row[sha256_idx])
+
+    def _load_cache(self, cache_file: str) -> bool:
+        """尝试从pickle缓存加载映射表，成功返回True"""
+        try:
+            if os.path.getmtime(cache_file) < os.path.getmtime(self.mapping_file):
+                return False
+            with open(cache_file, 'rb') as f:
+                self.mapping, self.rule_index = pickle.load(f)
+            return True
+        except Exception:
+            # 缓存缺失或损坏时回退到CSV解析
+            return False
+
+    def _save_cache(self, cache_file: str):
+        """将解析结果写入pickle缓存，失败时静默忽略"""
+        try:
+            with open(cache_file, 'wb') as f:
+                pickle.dump((self.mapping, self.rule_index), f,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            pass
+
     def query(
         self,
         rule: str,
         namespace: Optional[str] = None
-    ) -> List[Tuple[str, str, List[str]]]:
+    ) -> List[Tuple[str, str, Tuple[str, ...]]]:
         """
         查询规则对应的SHA256 hash
-        
+
         Args:
             rule: 规则名称
             namespace: 命名空间（可选）
-            
+
         Returns:
-            list: 匹配的结果列表 [(rule, namespace, [sha256_list])]
+            list: 匹配的结果列表 [(rule, namespace, (sha256, ...))]
+                  hash元组为映射表内部存储，调用方不应修改
         """
         results = []
-        
+
         if namespace:
             # 精确查询
             key = (rule, namespace)
             if key in self.mapping:
-                sha256_str = self.mapping[key]
-                sha256_list = [h.strip() for h in sha256_str.split(',') if h.strip()]
-                results.append((rule, namespace, sha256_list))
+                results.append((rule, namespace, self.mapping[key]))
         else:
-            # 只根据规则名查询
-            for (r, ns), sha256_str in self.mapping.items():
-                if r == rule:
-                    sha256_list = [h.strip() for h in sha256_str.split(',') if h.strip()]
-                    results.append((r, ns, sha256_list))
-        
+            # 只根据规则名查询，走二级索引避免全表扫描
+            for ns in self.rule_index.get(rule, ()):
+                results.append((rule, ns, self.mapping[(rule, ns)]))
+
         return results
     
     def get_sha256_list(
@@ -96,14 +175,25 @@ class RuleHashQuery:
         Returns:
             list: SHA256 hash列表
         """
-        results = self.query(rule, namespace)
-        all_sha256 = []
-        
-        for _, _, sha256_list in results:
-            all_sha256.extend(sha256_list)
-        
-        # 去重
-        return list(set(all_sha256))
+        return list(self._cached_sha256(rule, namespace))
+
+    def _iter_hashes(self, rule: str, namespace: Optional[str]):
+        """按匹配顺序逐个产出hash，不构造中间的结果列表"""
+        # 与query()一致，空字符串namespace同样视为查询全部命名空间
+        if namespace:
+            # 精确查询只命中一条记录
+            yield from self.mapping.get((rule, namespace), ())
+            return
+        for ns in self.rule_index.get(rule, ()):
+            yield from self.mapping[(rule, ns)]
+
+    def _get_sha256_tuple(
+        self,
+        rule: str,
+        namespace: Optional[str]
+    ) -> Tuple[str, ...]:
+        """实际执行查询（去重且保留出现顺序），结果由lru_cache缓存"""
+        return tuple(dict.fromkeys(self._iter_hashes(rule, namespace)))
 
 
 if __name__ == "__main__":
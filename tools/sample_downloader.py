@@ -4,13 +4,19 @@
 提供简洁的函数接口用于下载样本文件
 """
 import os
-import tempfile
+import re
+import shlex
+import shutil
 import subprocess
+import tempfile
 import time
-import shutil
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Tuple, Optional, Callable
 from pathlib import Path
 
+# SHA256为固定64位十六进制
+_SHA256_RE = re.compile(r'[0-9a-fA-F]{64}\Z')
+
 
 class SampleDownloaderAPI:
     """样本下载器API类"""
@@ -50,7 +56,38 @@ class SampleDownloaderAPI:
         self.target_port = target_port
         self.target_key = os.path.expanduser(target_key)
         self.target_workdir = target_workdir
-    
+        # SSH连接复用：同一实例的所有ssh/scp命令共享一条ControlMaster连接
+        # 首次调用建立连接，后续调用复用，免去重复的握手和认证
+        # mux socket放在实例私有的0700目录下，避免共享主机上被其他用户抢占
+        self._control_dir = tempfile.mkdtemp(prefix="ssh-mux-")
+        self._control_path = os.path.join(self._control_dir, "mux")
+
+    def _ssh_options(self) -> List[str]:
+        """构造所有ssh/scp命令共用的连接选项（含ControlMaster复用）"""
+        return [
+            "-o", f"ProxyCommand=ssh -i {self.jumper_key} -p {self.jumper_port} "
+                  f"-o ConnectTimeout=30 -o ServerAliveInterval=60 "
+                  f"-W %h:%p {self.jumper_user}@{self.jumper_host}",
+            "-o", "ConnectTimeout=30",
+            "-o", "ServerAliveInterval=60",
+            "-o", "ControlMaster=auto",
+            "-o", f"ControlPath={self._control_path}",
+            "-o", "ControlPersist=60s",
+        ]
+
+    def __del__(self):
+        # 实例销毁时关闭复用连接并删除socket所在的私有目录
+        try:
+            subprocess.run(
+                ["ssh", "-o", f"ControlPath={self._control_path}", "-O", "exit",
+                 f"{self.target_user}@{self.target_host}"],
+                capture_output=True,
+                timeout=10
+            )
+        except Exception:
+            pass
+        shutil.rmtree(self._control_dir, ignore_errors=True)
+
     def _run_ssh_command(
         self,
         command: str,
@@ -72,11 +109,7 @@ class SampleDownloaderAPI:
             try:
                 ssh_cmd = [
                     "ssh", "-i", self.target_key,
-                    "-o", f"ProxyCommand=ssh -i {self.jumper_key} -p {self.jumper_port} "
-                          f"-o ConnectTimeout=30 -o ServerAliveInterval=60 "
-                          f"-W %h:%p {self.jumper_user}@{self.jumper_host}",
-                    "-o", "ConnectTimeout=30",
-                    "-o", "ServerAliveInterval=60",
+                    *self._ssh_options(),
                     "-p", str(self.target_port),
                     f"{self.target_user}@{self.target_host}",
                     command
@@ -103,37 +136,69 @@ class SampleDownloaderAPI:
                 else:
                     return -1, "", str(e)
     
-    def _upload_file(
+    def _warm_connection(self):
+        """预热ControlMaster复用连接，失败时静默忽略（后续命令会自行建连）"""
+        try:
+            subprocess.run(
+                [
+                    "ssh", "-i", self.target_key,
+                    *self._ssh_options(),
+                    "-p", str(self.target_port),
+                    f"{self.target_user}@{self.target_host}",
+                    "true"
+                ],
+                capture_output=True,
+                timeout=60
+            )
+        except Exception:
+            pass
+
+    def _start_ssh_command(self, command: str) -> subprocess.Popen:
+        """异步启动SSH命令，返回Popen对象供调用方等待结果"""
+        ssh_cmd = [
+            "ssh", "-i", self.target_key,
+            *self._ssh_options(),
+            "-p", str(self.target_port),
+            f"{self.target_user}@{self.target_host}",
+            command
+        ]
+        return subprocess.Popen(
+            ssh_cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True
+        )
+
+    def _upload_hash_list(
         self,
-        local_file: str,
+        hash_list: List[str],
         remote_path: str,
         timeout: int = 300
     ) -> Tuple[bool, str]:
         """
-        通过跳板机上传文件到目标服务器
-        
+        通过SSH标准输入将hash列表直接写入目标服务器文件
+
+        相比临时文件+scp，省去一次本地磁盘写入和一次额外的SSH会话
+
         Args:
-            local_file: 本地文件路径
+            hash_list: SHA256哈希值列表
             remote_path: 远程文件路径
             timeout: 上传超时时间（秒）
-            
+
         Returns:
             (是否成功, 错误信息)
         """
         try:
-            scp_cmd = [
-                "scp", "-i", self.target_key,
-                "-o", f"ProxyCommand=ssh -i {self.jumper_key} -p {self.jumper_port} "
-                      f"-o ConnectTimeout=30 -o ServerAliveInterval=60 "
-                      f"-W %h:%p {self.jumper_user}@{self.jumper_host}",
-                "-o", "ConnectTimeout=30",
-                "-o", "ServerAliveInterval=60",
-                "-P", str(self.target_port),
-                local_file,
-                f"{self.target_user}@{self.target_host}:{remote_path}"
+            ssh_cmd = [
+                "ssh", "-i", self.target_key,
+                *self._ssh_options(),
+                "-p", str(self.target_port),
+                f"{self.target_user}@{self.target_host}",
+                f"cat > {remote_path}"
             ]
             result = subprocess.run(
-                scp_cmd,
+                ssh_cmd,
+                input='\n'.join(hash_list) + '\n',
                 capture_output=True,
                 text=True,
                 timeout=timeout
@@ -161,20 +226,20 @@ class SampleDownloaderAPI:
         """
         try:
             os.makedirs(os.path.dirname(local_dir), exist_ok=True)
-            
-            scp_cmd = [
-                "scp", "-r", "-i", self.target_key,
-                "-o", f"ProxyCommand=ssh -i {self.jumper_key} -p {self.jumper_port} "
-                      f"-o ConnectTimeout=30 -o ServerAliveInterval=60 "
-                      f"-W %h:%p {self.jumper_user}@{self.jumper_host}",
-                "-o", "ConnectTimeout=30",
-                "-o", "ServerAliveInterval=60",
-                "-P", str(self.target_port),
-                f"{self.target_user}@{self.target_host}:{remote_dir}",
-                local_dir
+
+            # rsync相比scp -r支持传输压缩和断点续传
+            ssh_transport = "ssh " + " ".join(
+                shlex.quote(opt) for opt in
+                ["-i", self.target_key, *self._ssh_options(), "-p", str(self.target_port)]
+            )
+            rsync_cmd = [
+                "rsync", "-az", "--partial",
+                "-e", ssh_transport,
+                f"{self.target_user}@{self.target_host}:{remote_dir}/",
+                local_dir + "/"
             ]
             result = subprocess.run(
-                scp_cmd,
+                rsync_cmd,
                 capture_output=True,
                 text=True,
                 timeout=timeout
@@ -183,6 +248,73 @@ class SampleDownloaderAPI:
         except Exception as e:
             return False, str(e)
     
+    def _download_directory_flat(
+        self,
+        remote_dir: str,
+        local_dir: str,
+        timeout: int = 600
+    ) -> Tuple[bool, str]:
+        """
+        以tar流方式将远程目录内容直接下载到本地目录
+
+        单条SSH连接、单次目录遍历，无需临时目录和逐文件移动
+
+        Args:
+            remote_dir: 远程目录路径
+            local_dir: 本地目录路径（文件直接落在该目录下）
+            timeout: 下载超时时间（秒）
+
+        Returns:
+            (是否成功, 错误信息)
+        """
+        try:
+            os.makedirs(local_dir, exist_ok=True)
+
+            ssh_cmd = [
+                "ssh", "-i", self.target_key,
+                *self._ssh_options(),
+                "-p", str(self.target_port),
+                f"{self.target_user}@{self.target_host}",
+                f"cd {remote_dir} && tar cf - ."
+            ]
+            tar_cmd = ["tar", "xf", "-", "-C", local_dir]
+
+            producer = subprocess.Popen(
+                ssh_cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE
+            )
+            consumer = subprocess.Popen(
+                tar_cmd,
+                stdin=producer.stdout,
+                stderr=subprocess.PIPE
+            )
+            # 关闭父进程持有的管道端，让consumer能感知到EOF
+            producer.stdout.close()
+
+            # 两次等待共用同一超时预算，第二次只等剩余时间
+            deadline = time.monotonic() + timeout
+            try:
+                _, producer_err = producer.communicate(timeout=timeout)
+                remaining = max(deadline - time.monotonic(), 1)
+                _, consumer_err = consumer.communicate(timeout=remaining)
+            except subprocess.TimeoutExpired:
+                # 超时后必须杀掉并回收两个子进程，
+                # 避免残留的ssh+tar继续向本地目录写入文件
+                for p in (producer, consumer):
+                    p.kill()
+                for p in (producer, consumer):
+                    p.communicate()
+                return False, "下载超时"
+
+            if producer.returncode != 0:
+                return False, producer_err.decode(errors='replace')
+            if consumer.returncode != 0:
+                return False, consumer_err.decode(errors='replace')
+            return True, ""
+        except Exception as e:
+            return False, str(e)
+
     def download_samples(
         self,
         hash_list: List[str],
@@ -220,79 +352,85 @@ class SampleDownloaderAPI:
                 return False, "", "hash列表不能为空"
             
             log(f"开始下载 {len(hash_list)} 个样本...")
-            
-            # 创建临时文件存储hash列表
-            with tempfile.NamedTemporaryFile(
-                mode='w',
-                suffix='.txt',
-                delete=False
-            ) as f:
-                f.write('\n'.join(hash_list))
-                hash_file_path = f.name
-            
-            log(f"已创建hash列表文件: {hash_file_path}")
-            
-            # 上传hash文件到目标服务器
-            log("正在上传hash列表文件到目标服务器...")
+
+            # 预热SSH复用连接的同时在当前线程校验hash格式
+            # 校验失败时立即返回，不等待预热完成
+            executor = ThreadPoolExecutor(max_workers=1)
+            try:
+                warm_future = executor.submit(self._warm_connection)
+                invalid = [h for h in hash_list if not _SHA256_RE.match(h)]
+                if invalid:
+                    return False, "", f"无效的SHA256 hash: {', '.join(invalid[:5])}"
+                warm_future.result()
+            finally:
+                executor.shutdown(wait=False)
+
+            # 通过SSH直接写入hash列表，无需本地临时文件
+            log("正在上传hash列表到目标服务器...")
             remote_hash_file = f"{self.target_workdir}/hashList.txt"
-            success, error = self._upload_file(hash_file_path, remote_hash_file)
-            
+            success, error = self._upload_hash_list(hash_list, remote_hash_file)
+
             if not success:
-                os.unlink(hash_file_path)
                 return False, "", f"上传hash文件失败: {error}"
-            
+
             log("hash文件上传成功")
             
-            # 在目标服务器上执行下载脚本
+            # 异步启动目标服务器上的下载脚本，本地准备工作与其并行
+            # 超时和瞬时异常的重试策略与_run_ssh_command保持一致
             log("正在目标服务器上执行下载脚本...")
             download_cmd = (
                 f"cd {self.target_workdir} && "
                 f"python3 obs_collect_new.py --input ./hashList.txt --output ./{output_dirname}"
             )
-            rc, out, err = self._run_ssh_command(download_cmd, timeout=600)
-            
-            if rc != 0:
-                os.unlink(hash_file_path)
+            max_retries = 3
+            for attempt in range(max_retries):
+                proc = self._start_ssh_command(download_cmd)
+
+                # 脚本运行期间创建本地输出目录
+                local_output_dir = os.path.abspath(local_output_dir)
+                os.makedirs(local_output_dir, exist_ok=True)
+
+                try:
+                    out, err = proc.communicate(timeout=600)
+                    break
+                except subprocess.TimeoutExpired:
+                    # 杀掉并回收旧进程，避免重试的新实例与其并发执行
+                    proc.kill()
+                    proc.communicate()
+                    if attempt < max_retries - 1:
+                        time.sleep(5)
+                        continue
+                    return False, "", "下载脚本执行超时"
+                except Exception as e:
+                    proc.kill()
+                    proc.communicate()
+                    if attempt < max_retries - 1:
+                        time.sleep(5)
+                        continue
+                    return False, "", str(e)
+
+            if proc.returncode != 0:
                 return False, "", f"下载脚本执行失败: {err}"
-            
+
             log("下载脚本执行成功")
             if out:
                 log(f"脚本输出: {out}")
-            
-            # 创建本地输出目录
-            local_output_dir = os.path.abspath(local_output_dir)
-            os.makedirs(local_output_dir, exist_ok=True)
-            
+
             # 从目标服务器下载整个目录到本地
             log("正在从目标服务器下载文件到本地...")
             remote_download_dir = f"{self.target_workdir}/{output_dirname}"
             
             if flat_output:
-                # 直接下载到输出目录，不创建子目录
-                # 先下载到临时目录，然后移动文件
-                temp_dir = tempfile.mkdtemp()
-                temp_download_path = os.path.join(temp_dir, output_dirname)
-                
-                success, error = self._download_directory(
+                # tar流直接解包到输出目录，不创建子目录
+                success, error = self._download_directory_flat(
                     remote_download_dir,
-                    temp_download_path,
+                    local_output_dir,
                     timeout=600
                 )
-                
+
                 if not success:
-                    shutil.rmtree(temp_dir, ignore_errors=True)
-                    os.unlink(hash_file_path)
                     return False, "", f"下载文件失败: {error}"
-                
-                # 移动文件到目标目录
-                os.makedirs(local_output_dir, exist_ok=True)
-                for filename in os.listdir(temp_download_path):
-                    src = os.path.join(temp_download_path, filename)
-                    dst = os.path.join(local_output_dir, filename)
-                    shutil.move(src, dst)
-                
-                # 清理临时目录
-                shutil.rmtree(temp_dir, ignore_errors=True)
+
                 local_download_path = local_output_dir
             else:
                 # 创建子目录
@@ -305,12 +443,12 @@ class SampleDownloaderAPI:
                 )
                 
                 if not success:
-                    os.unlink(hash_file_path)
                     return False, "", f"下载文件失败: {error}"
             
             log("文件下载成功")
             
             # 清理远程服务器上的输出目录
+            # 走ControlMaster复用连接，失败时仅记录日志，不影响下载结果
             if cleanup_remote:
                 log("正在删除服务器上的输出目录...")
                 cleanup_cmd = f"cd {self.target_workdir} && rm -rf {output_dirname}"
@@ -321,9 +459,6 @@ class SampleDownloaderAPI:
                 else:
                     log(f"删除服务器输出目录失败: {err}")
             
-            # 清理本地临时文件
-            os.unlink(hash_file_path)
-            
             log(f"任务完成，文件已下载到: {local_download_path}")
             return True, local_download_path, ""
             